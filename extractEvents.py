@@ -14,16 +14,17 @@ Key Features:
 - Supports custom time zones
 
 Dependencies:
-- ics: For basic iCalendar operations
-- icalendar: For more advanced iCalendar parsing
+- icalendar: For iCalendar parsing and writing
 - recurring_ical_events: To handle recurring events
-- pytz: For timezone operations
+- zoneinfo: For timezone operations
 - openai: For integration with GPT models
+- diskcache: For caching GPT summaries between runs
+- orjson: For fast JSON encoding/decoding of batched GPT requests
 - dotenv: For loading environment variables
 
 Global Settings:
 - DAYS_TO_INCLUDE: Number of days to include in event extraction (default: 1)
-- DEBUG: Toggle for debug printing (default: True)
+- DEBUG: Toggle for debug logging (default: True)
 - GPT_MODEL: Specifies the GPT model to use (default: "gpt-4-turbo")
 - ICSP_PATH: Path to the icsp binary
 
@@ -40,14 +41,23 @@ are properly set before running the script.
 import sys
 import subprocess
 import os
-from ics import Calendar, Event
-from datetime import datetime, timedelta, date, time
-import pytz
+import functools
+import concurrent.futures
+import hashlib
+import orjson
+import logging
+import uuid
+from collections import defaultdict
+from operator import attrgetter
+from typing import NamedTuple
+from datetime import datetime, timedelta, date, time, timezone
+from zoneinfo import ZoneInfo
 import recurring_ical_events
 import icalendar
 import signal
 from dotenv import load_dotenv
 from openai import OpenAI
+from diskcache import Cache
 
 # Load environment variables
 load_dotenv()
@@ -61,131 +71,184 @@ ICSP_PATH = "/Users/echeng/.local/bin/icsp"  # Adjust this path as needed
 # Global variables
 DAYS_TO_INCLUDE = 1  # 0 = only the provided day. Adjust this value as needed
 DEBUG = True  # Set this to False to turn off debug printing
+POOL_MIN_BYTES = 2 * 1024 * 1024  # Only parse ICS files in a process pool above this total size
+
+# Debug output goes through logging so messages are only formatted when DEBUG is on.
+# The module logger gets its own handler at import time, so process pool workers log
+# the same way without touching the importer's root logger.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG if DEBUG else logging.INFO)
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+logger.propagate = False
 
 # Add this near the top of the file, after the openai import
 GPT_MODEL = "gpt-4-turbo"
 
-def timeout_handler(signum, frame):
-    raise TimeoutError("Event processing timed out")
-
-def extract_recurring_events_ics(ical_file_paths, target_timezone='America/Los_Angeles'):
-    if DEBUG:
-        print(f"Starting extraction from {len(ical_file_paths)} files with target timezone {target_timezone}", flush=True)
-
-    # Use a default timezone if an empty string is provided
-    if not target_timezone:
-        target_timezone = 'America/Los_Angeles'  # or any other default timezone you prefer
-
-    all_events = []
+# Resolved once at import instead of on every event in the hot loops
+_UTC = timezone.utc
+_TMIN = time.min
+_TMAX = time.max
 
-    for ical_file_path in ical_file_paths:
-        with open(ical_file_path, 'r') as file:
-            calendar_data = file.read()
+# Persistent cache of GPT summaries, so recurring event titles are only summarized once
+SUMMARY_CACHE_PATH = os.path.expanduser("~/.vestaboard_gpt_cache")
+SUMMARY_CACHE_EXPIRE = 30 * 86400  # seconds
+_cache = Cache(SUMMARY_CACHE_PATH)
 
-        # Parse the calendar using icalendar
-        cal = icalendar.Calendar.from_ical(calendar_data)
+class CalendarEvent(NamedTuple):
+    title: str
+    location: str
+    start_time: datetime
+    end_time: datetime
+    is_recurring: bool
 
-        # Get the current date
-        current_date = datetime.now(pytz.timezone(target_timezone)).date()
-        end_date = current_date + timedelta(days=DAYS_TO_INCLUDE)
-
-        if DEBUG:
-            print(f"Parsed calendar data. Current date: {current_date}, End date: {end_date}", flush=True)
+def timeout_handler(signum, frame):
+    raise TimeoutError("Event processing timed out")
 
-        # Set a timeout for event processing
-        signal.signal(signal.SIGALRM, timeout_handler)
-        signal.alarm(5)  # 5 seconds timeout
+@functools.lru_cache(maxsize=8)
+def _get_tz(name):
+    return ZoneInfo(name)
 
-        try:
-            query = recurring_ical_events.of(cal).after(current_date)
+def _process_single_ics(ical_file_path, target_timezone, current_date, end_date):
+    """Parse one ICS file and return its events between current_date and end_date.
 
-            if DEBUG:
-                print(f"Retrieved events after {current_date}", flush=True)
+    Runs in a worker process, so the SIGALRM timeout below fires on the worker's
+    own main thread.
+    """
+    tz = _get_tz(target_timezone)
 
-            filtered_events = []
+    # Parse the calendar using icalendar, straight from bytes to skip the str decode
+    with open(ical_file_path, 'rb') as file:
+        cal = icalendar.Calendar.from_ical(file.read())
 
-            for event in query:
-                if DEBUG:
-                    print(f"Processing event: {event.get('SUMMARY', 'No Title')}", flush=True)
+    logger.debug("Parsed calendar data from %s. Current date: %s, End date: %s", ical_file_path, current_date, end_date)
 
-                start_time = event['DTSTART'].dt
-                end_time = event['DTEND'].dt if 'DTEND' in event else start_time
+    filtered_events = []
 
-                if DEBUG:
-                    print(f"  Original start time: {start_time}, end time: {end_time}", flush=True)
+    # Set a timeout for event processing
+    signal.signal(signal.SIGALRM, timeout_handler)
+    signal.alarm(5)  # 5 seconds timeout
 
-                # Convert to target timezone if necessary
-                if isinstance(start_time, datetime):
-                    start_time = start_time.astimezone(pytz.timezone(target_timezone))
-                    end_time = end_time.astimezone(pytz.timezone(target_timezone))
-                    if DEBUG:
-                        print(f"  Converted to target timezone. New start time: {start_time}, end time: {end_time}", flush=True)
+    try:
+        # Bound the query so unbounded RRULEs only expand instances inside our window.
+        # The bounds are midnights in the target timezone: naive dates would be applied in
+        # each event's own timezone. between()'s stop is exclusive, so the extra day makes
+        # end_date itself inclusive.
+        window_start = datetime.combine(current_date, _TMIN, tzinfo=tz)
+        window_stop = datetime.combine(end_date + timedelta(days=1), _TMIN, tzinfo=tz)
+        query = recurring_ical_events.of(cal).between(window_start, window_stop)
+
+        logger.debug("Retrieved events between %s and %s", current_date, end_date)
+
+        for event in query:
+            title = event.get('SUMMARY', 'No Title')
+            logger.debug("Processing event: %s", title)
+
+            start_time = event['DTSTART'].dt
+            end_time = event['DTEND'].dt if 'DTEND' in event else start_time
+
+            logger.debug("  Original start time: %s, end time: %s", start_time, end_time)
+
+            # Convert to target timezone if necessary
+            if isinstance(start_time, datetime):
+                start_time = start_time.astimezone(tz)
+                end_time = end_time.astimezone(tz)
+                logger.debug("  Converted to target timezone. New start time: %s, end time: %s", start_time, end_time)
+
+            # Handle all-day events (date objects) and datetime objects
+            if isinstance(start_time, (date, time)) and not isinstance(start_time, datetime):
+                start_time = datetime(start_time.year, start_time.month, start_time.day, tzinfo=_UTC)
+
+            if isinstance(end_time, date) and not isinstance(end_time, datetime):
+                # Same as combining with time.max, in a single allocation
+                end_time = datetime(end_time.year, end_time.month, end_time.day, 23, 59, 59, 999999, tzinfo=_UTC)
+
+            # Plain str so results pickle cleanly back to the parent process
+            filtered_events.append(CalendarEvent(
+                title=str(title),
+                location=str(event.get('LOCATION', '')),
+                start_time=start_time,
+                end_time=end_time,
+                is_recurring='RRULE' in event
+            ))
+
+            logger.debug("Added event to filtered list: %s - %s", title, start_time.date())
+
+    except TimeoutError:
+        print(f"Warning: Event processing timed out for file {ical_file_path}. Skipping remaining events.", flush=True)
+    except Exception as e:
+        print(f"Error processing events from {ical_file_path}: {str(e)}", flush=True)
+    finally:
+        signal.alarm(0)  # Disable the alarm
 
-                # Handle all-day events (date objects) and datetime objects
-                if isinstance(start_time, (date, time)) and not isinstance(start_time, datetime):
-                    start_time = datetime.combine(start_time, time.min)
-                    start_time = start_time.replace(tzinfo=pytz.UTC)
+    return filtered_events
 
-                if isinstance(end_time, date) and not isinstance(end_time, datetime):
-                    end_time = datetime.combine(end_time, time.max)
-                    end_time = end_time.replace(tzinfo=pytz.UTC)
+def extract_recurring_events_ics(ical_file_paths, target_timezone='America/Los_Angeles'):
+    logger.debug("Starting extraction from %s files with target timezone %s", len(ical_file_paths), target_timezone)
 
-                # Stop if we've reached events beyond our end date
-                if start_time.date() > end_date:
-                    if DEBUG:
-                        print(f"Reached event beyond end date. Stopping.", flush=True)
-                    break
+    # Use a default timezone if an empty string is provided
+    if not target_timezone:
+        target_timezone = 'America/Los_Angeles'  # or any other default timezone you prefer
 
-                filtered_events.append({
-                    "title": event.get('SUMMARY', 'No Title'),
-                    "location": event.get('LOCATION', ''),
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "is_recurring": 'RRULE' in event
-                })
+    # Get the current date
+    current_date = datetime.now(_get_tz(target_timezone)).date()
+    end_date = current_date + timedelta(days=DAYS_TO_INCLUDE)
 
-                if DEBUG:
-                    print(f"Added event to filtered list: {event.get('SUMMARY', 'No Title')} - {start_time.date()}", flush=True)
+    process_file = functools.partial(_process_single_ics, target_timezone=target_timezone,
+                                     current_date=current_date, end_date=end_date)
 
-        except TimeoutError:
-            print(f"Warning: Event processing timed out for file {ical_file_path}. Skipping remaining events.", flush=True)
-        except Exception as e:
-            print(f"Error processing events from {ical_file_path}: {str(e)}", flush=True)
-        finally:
-            signal.alarm(0)  # Disable the alarm
+    # Parsing is CPU-bound pure Python, so spread large inputs across processes.
+    # Small inputs stay serial: spawned workers re-run this module's setup, which costs more than they save.
+    cpu_count = os.cpu_count() or 1
+    total_bytes = sum(os.path.getsize(path) for path in ical_file_paths)
+    if len(ical_file_paths) > 1 and cpu_count > 1 and total_bytes >= POOL_MIN_BYTES:
+        max_workers = min(len(ical_file_paths), cpu_count)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(process_file, ical_file_paths))
+    else:
+        results = [process_file(path) for path in ical_file_paths]
 
-        all_events.extend(filtered_events)
+    all_events = sum(results, [])
 
-    if DEBUG:
-        print(f"Finished processing. Total events filtered: {len(all_events)}", flush=True)
+    logger.debug("Finished processing. Total events filtered: %s", len(all_events))
 
     return all_events
 
-def filter_events_by_date(events, filter_date):
-    if DEBUG:
-        print(f"Filtering events for date: {filter_date}", flush=True)
+def group_events_by_date(events):
+    """Bucket events by their start date so per-date lookups are O(1)."""
+    events_by_date = defaultdict(list)
+    for event in events:
+        events_by_date[event.start_time.date()].append(event)
+    return events_by_date
 
-    filter_date = datetime.strptime(filter_date, "%Y-%m-%d").date()
-    filtered_events = []
+def filter_events_by_date(events_by_date, filter_date):
+    logger.debug("Filtering events for date: %s", filter_date)
 
-    for event in events:
-        event_date = event['start_time'].date()
-        if event_date == filter_date:
-            filtered_events.append(event)
-            if DEBUG:
-                print(f"Added event to filtered list: {event['title']} - {event_date}", flush=True)
+    filter_date = datetime.strptime(filter_date, "%Y-%m-%d").date()
+    filtered_events = events_by_date.get(filter_date, [])
 
-    if DEBUG:
-        print(f"Finished filtering. Total events for {filter_date}: {len(filtered_events)}", flush=True)
+    if logger.isEnabledFor(logging.DEBUG):
+        for event in filtered_events:
+            logger.debug("Added event to filtered list: %s - %s", event.title, filter_date)
+    logger.debug("Finished filtering. Total events for %s: %s", filter_date, len(filtered_events))
 
     return filtered_events
 
+def _summary_cache_key(title, max_length):
+    return hashlib.sha1(f"{GPT_MODEL}|{max_length}|{title}".encode()).hexdigest()
+
+@functools.lru_cache(maxsize=None)
 def summarize_with_gpt(title, max_length):
-    if DEBUG:
-        print(f"Attempting to summarize title: '{title}' with max length {max_length}", flush=True)
+    logger.debug("Attempting to summarize title: '%s' with max length %s", title, max_length)
+    key = _summary_cache_key(title, max_length)
+    cached = _cache.get(key)
+    if cached is not None:
+        logger.debug("Using cached summary for '%s'", title)
+        return cached
     try:
-        if DEBUG:
-            print(f"Sending request to {GPT_MODEL}", flush=True)
+        logger.debug("Sending request to %s", GPT_MODEL)
         response = client.chat.completions.create(
             model=GPT_MODEL,
             messages=[
@@ -203,36 +266,114 @@ def summarize_with_gpt(title, max_length):
             temperature=0.7
         )
         summary = response.choices[0].message.content.strip()
-        if DEBUG:
-            print(f"Received summary from {GPT_MODEL}: '{summary}'", flush=True)
+        logger.debug("Received summary from %s: '%s'", GPT_MODEL, summary)
         final_summary = summary[:max_length]
-        if DEBUG:
-            print(f"Final summary (truncated if necessary): '{final_summary}'", flush=True)
+        logger.debug("Final summary (truncated if necessary): '%s'", final_summary)
+        _cache.set(key, final_summary, expire=SUMMARY_CACHE_EXPIRE)
         return final_summary
     except Exception as e:
-        if DEBUG:
-            print(f"Error summarizing with {GPT_MODEL}: {e}", flush=True)
+        logger.debug("Error summarizing with %s: %s", GPT_MODEL, e)
         return title[:max_length]
 
+def summarize_batch_with_gpt(items):
+    """Summarize several (title, max_length) pairs with a single GPT request.
+
+    Falls back to summarize_with_gpt per title if the batched request fails.
+    """
+    if not items:
+        return []
+
+    # Identical (title, max_length) pairs only need summarizing once
+    unique_items = list(dict.fromkeys(items))
+
+    # Only send titles that aren't already in the persistent cache
+    results = {}
+    missing = []
+    for item in unique_items:
+        summary = _cache.get(_summary_cache_key(*item))
+        if summary is not None:
+            results[item] = summary
+        else:
+            missing.append(item)
+    if not missing:
+        logger.debug("All %s summaries found in cache", len(unique_items))
+        return [results[item] for item in items]
+
+    logger.debug("Attempting to summarize %s titles in one request", len(missing))
+    payload = [{"id": i, "title": title, "max_len": max_length}
+               for i, (title, max_length) in enumerate(missing)]
+    entries = []
+    try:
+        logger.debug("Sending batch request to %s", GPT_MODEL)
+        response = client.chat.completions.create(
+            model=GPT_MODEL,
+            messages=[
+                {"role": "system", "content": "Summarize each event title in the JSON list below in max_len characters or less. "
+                 "Use common abbreviations, make results as standalone readable as possible. Do not use any hashtags or other formatting. "
+                 "shorten 'Peninsula Self Defense' to 'BJJ'. "
+                 "Do not add words if they are already within max length "
+                 "If names are included (including Mako and Kai), try hard not to omit. "
+                 'Respond with a JSON object of the form {"summaries": [{"id": <id>, "text": <summary>}, ...]} '
+                 "containing one entry for every id."
+                 },
+                {"role": "user", "content": orjson.dumps(payload).decode()}
+            ],
+            response_format={"type": "json_object"},
+            n=1,
+            stop=None,
+            temperature=0.7
+        )
+        entries = orjson.loads(response.choices[0].message.content)["summaries"]
+    except Exception as e:
+        logger.debug("Error batch summarizing with %s: %s", GPT_MODEL, e)
+
+    # Validate entries one at a time so a single bad entry doesn't discard the batch.
+    # Models often echo ids back as strings, so normalize them to ints.
+    summaries = {}
+    for entry in entries if isinstance(entries, list) else []:
+        try:
+            summaries[int(entry["id"])] = entry["text"].strip()
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            logger.debug("Skipping malformed summary entry %r: %s", entry, e)
+    logger.debug("Received %s summaries from %s", len(summaries), GPT_MODEL)
+
+    for i, item in enumerate(missing):
+        title, max_length = item
+        if summaries.get(i):
+            final_summary = summaries[i][:max_length]
+            _cache.set(_summary_cache_key(title, max_length), final_summary, expire=SUMMARY_CACHE_EXPIRE)
+            results[item] = final_summary
+        else:
+            results[item] = summarize_with_gpt(title, max_length)
+    return [results[item] for item in items]
+
 def format_events_for_text_file(events, filter_date):
+    all_day_flags = []
+    items = []
+    for event in events:
+        is_all_day = event.start_time.time() == _TMIN and event.end_time.time() == _TMAX
+        all_day_flags.append(is_all_day)
+        # All-day events get a wider summary since they have no time prefix
+        items.append((event.title, 22 if is_all_day else 16))
+
+    summaries = summarize_batch_with_gpt(items)
+
     all_day_events = []
     timed_events = []
-    for event in events:
-        if event['start_time'].time() == time.min and event['end_time'].time() == time.max:
+    for event, is_all_day, summary in zip(events, all_day_flags, summaries):
+        if is_all_day:
             # All-day event
-            summary = summarize_with_gpt(event['title'], 22)
             all_day_events.append(summary)
         else:
             # Timed event
-            start_time = event['start_time'].strftime("%H:%M")
-            summary = summarize_with_gpt(event['title'], 16)
-            timed_events.append(f"{start_time} {summary}")
+            timed_events.append((event.start_time, summary))
 
     # Sort all-day events alphabetically
     all_day_events.sort()
 
-    # Sort timed events by start time
+    # Sort timed events by their actual start time (then summary), then format them
     timed_events.sort()
+    timed_events = [f"{start_time.strftime('%H:%M')} {summary}" for start_time, summary in timed_events]
 
     # Combine all-day events and timed events
     formatted_events = timed_events + all_day_events
@@ -243,8 +384,7 @@ def format_events_for_text_file(events, filter_date):
     return header + "\n".join(formatted_events)
 
 if __name__ == "__main__":
-    if DEBUG:
-        print("Script started", flush=True)
+    logger.debug("Script started")
 
     import argparse
 
@@ -259,36 +399,40 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    if DEBUG:
-        print(f"Input parameters: ics_file_paths={args.ics_files}, filter_date={args.date}, "
-              f"target_timezone={args.timezone}, output_folder={args.output}", flush=True)
+    logger.debug("Input parameters: ics_file_paths=%s, filter_date=%s, target_timezone=%s, output_folder=%s",
+                 args.ics_files, args.date, args.timezone, args.output)
 
     expanded_cal = extract_recurring_events_ics(args.ics_files, args.timezone)
-    filtered_events = filter_events_by_date(expanded_cal, args.date)
+    events_by_date = group_events_by_date(expanded_cal)
+    filtered_events = filter_events_by_date(events_by_date, args.date)
 
     # Sort filtered events by start time
-    filtered_events.sort(key=lambda x: x['start_time'])
+    filtered_events.sort(key=attrgetter('start_time'))
 
     # Generate the new filename for the ICS file
     new_ics_filename = os.path.join(args.output, 'combined_expanded.ics')
 
-    if DEBUG:
-        print(f"Writing filtered events to {new_ics_filename}", flush=True)
+    logger.debug("Writing filtered events to %s", new_ics_filename)
 
     # Write the filtered events to the new ICS file
-    cal = Calendar()
+    cal = icalendar.Calendar()
+    cal.add('prodid', '-//vestaboard//extractEvents//EN')
+    cal.add('version', '2.0')
+    dtstamp = datetime.now(_UTC)
     for event in filtered_events:
-        cal.events.add(
-            Event(
-                name=event['title'],
-                begin=event['start_time'],
-                end=event['end_time'],
-                location=event['location']
-            )
-        )
-
-    with open(new_ics_filename, 'w') as f:
-        f.write(cal.serialize())
+        ical_event = icalendar.Event()
+        ical_event.add('uid', f"{uuid.uuid4()}@vestaboard")
+        ical_event.add('dtstamp', dtstamp)
+        ical_event.add('summary', event.title)
+        # Write UTC timestamps, as the ics writer did, so no VTIMEZONE components are needed
+        ical_event.add('dtstart', event.start_time.astimezone(_UTC))
+        ical_event.add('dtend', event.end_time.astimezone(_UTC))
+        if event.location:
+            ical_event.add('location', event.location)
+        cal.add_component(ical_event)
+
+    with open(new_ics_filename, 'wb') as f:
+        f.write(cal.to_ical())
 
     print(f"Filtered calendar written to: {new_ics_filename}")
 
@@ -301,8 +445,7 @@ if __name__ == "__main__":
 
     print(f"Formatted events written to: {text_filename}")
 
-    if DEBUG:
-        print("Script completed successfully", flush=True)
+    logger.debug("Script completed successfully")
 
 # # Generate the base filename without extension
 # new_filename_base = ics_file_path.rsplit('.', 1)[0] + '_expanded'
@@ -1,10 +1,13 @@
-import feedparser
 import xml.etree.ElementTree as ET
+import orjson
+import hashlib
 from dotenv import load_dotenv
 from openai import OpenAI
+from diskcache import Cache
 import requests
+import urllib3
 import os
-from bs4 import BeautifulSoup
+from lxml import html
 import argparse
 from datetime import datetime
 
@@ -17,23 +20,111 @@ client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 # Global variables
 RSS_FEED_URL = "http://rss.cnn.com/rss/cnn_topstories.rss"  # Example: CNN Top Stories
 DEBUG = True  # Debug flag to enable printing progress messages
+RSS_CACHE_PATH = os.path.expanduser("~/.vestaboard_rss.json")  # ETag/Last-Modified and last fetched articles
+POEM_CACHE_PATH = os.path.expanduser("~/.vestaboard_poem_cache")  # Poems keyed by headline set
+POEM_CACHE_EXPIRE = 6 * 3600  # seconds
+
+_poem_cache = Cache(POEM_CACHE_PATH)
+
+# Shared HTTP session so the feed and article fetches reuse keep-alive connections
+_SESSION = requests.Session()
+
+def load_rss_cache():
+    """
+    Load the cached RSS validators and articles from the previous run.
+
+    Returns:
+    dict: Cache with "etag", "modified" and "articles" keys, empty if unavailable
+    """
+    try:
+        with open(RSS_CACHE_PATH, "rb") as f:
+            return orjson.loads(f.read())
+    except (IOError, ValueError):
+        return {}
+
+def save_rss_cache(etag, modified, articles):
+    """
+    Persist the RSS validators and articles for the next run.
+    """
+    try:
+        with open(RSS_CACHE_PATH, "wb") as f:
+            f.write(orjson.dumps({"etag": etag, "modified": modified, "articles": articles}))
+    except IOError as e:
+        if DEBUG:
+            print(f"Could not write RSS cache: {e}", flush=True)
+
+def _local_name(tag):
+    """Strip any XML namespace from a tag, e.g. '{http://www.w3.org/2005/Atom}entry' -> 'entry'."""
+    return tag.rsplit("}", 1)[-1]
+
+def _child_text(elem, name):
+    for child in elem:
+        if _local_name(child.tag) == name:
+            return (child.text or "").strip()
+    return ""
+
+def _entry_link(elem):
+    """Return an item's link: element text for RSS, the href attribute for Atom."""
+    for child in elem:
+        if _local_name(child.tag) != "link":
+            continue
+        if child.get("href") is not None:
+            if child.get("rel", "alternate") == "alternate":
+                return child.get("href").strip()
+        elif child.text:
+            return child.text.strip()
+    return ""
+
+def parse_rss_items(stream):
+    """
+    Stream-parse an RSS 2.0, RSS 1.0 (RDF) or Atom document, extracting only
+    item titles and links.
+
+    Returns:
+    list of tuples: Each tuple contains (title, link) for an article
+    """
+    articles = []
+    for _, elem in ET.iterparse(stream):
+        if _local_name(elem.tag) in ("item", "entry"):
+            articles.append((_child_text(elem, "title"), _entry_link(elem)))
+            elem.clear()
+    return articles
 
 def fetch_rss_articles():
     """
     Fetch articles from the RSS feed and extract title and link for each.
+
+    Sends the ETag/Last-Modified from the previous run, and reuses the cached
+    articles if the feed hasn't changed (HTTP 304). If the feed can't be fetched
+    or parsed, falls back to the cached articles, or an empty list.
     
     Returns:
     list of tuples: Each tuple contains (title, link) for an article
     """
     if DEBUG:
         print("Fetching RSS articles...", flush=True)
-    feed = feedparser.parse(RSS_FEED_URL)
-    articles = []
-
-    for entry in feed.entries:
-        title = entry.title
-        link = entry.link
-        articles.append((title, link))
+    cache = load_rss_cache()
+    cached_articles = [tuple(article) for article in cache.get("articles") or []]
+    headers = {}
+    if cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache.get("modified"):
+        headers["If-Modified-Since"] = cache["modified"]
+
+    try:
+        with _SESSION.get(RSS_FEED_URL, headers=headers, stream=True, timeout=10) as response:
+            if response.status_code == 304:
+                if DEBUG:
+                    print(f"Feed not modified, using {len(cached_articles)} cached articles", flush=True)
+                return cached_articles
+
+            response.raise_for_status()
+            response.raw.decode_content = True
+            articles = parse_rss_items(response.raw)
+            save_rss_cache(response.headers.get("ETag"), response.headers.get("Last-Modified"), articles)
+    except (requests.RequestException, urllib3.exceptions.HTTPError, ET.ParseError) as e:
+        print(f"Error fetching RSS feed: {e}. Using {len(cached_articles)} cached articles.", flush=True)
+        return cached_articles
 
     if DEBUG:
         print(f"Fetched {len(articles)} articles", flush=True)
@@ -79,56 +170,102 @@ def read_article_content(url):
     """
     if DEBUG:
         print(f"Reading article content from {url}", flush=True)
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, 'html.parser')
+    response = _SESSION.get(url, timeout=5)
+    tree = html.fromstring(response.content)
 
     # This is a simple extraction and might need to be adjusted based on the website's structure
-    paragraphs = soup.find_all('p')
-    content = ' '.join([p.text for p in paragraphs])
+    paragraphs = tree.xpath('//p')
+    content = ' '.join([p.text_content() for p in paragraphs])
 
     if DEBUG:
         print(f"Article content length: {len(content)} characters", flush=True)
     return content
 
-def generate_poem(article_title):
+def poem_from_json(content):
     """
-    Use OpenAI GPT to generate a humorous poem based on the article content.
-    
+    Recover the poem text from a JSON-mode response.
+
+    Accepts the requested {"lines": [...]} shape, and otherwise the first string
+    (or list of strings) found in the object, e.g. {"poem": "..."}.
+
     Returns:
-    str: A humorous poem summarizing the article
+    str or None: The poem text, or None if the response holds no usable text
     """
-    if DEBUG:
-        print("Generating poem...", flush=True)
-    prompt = f"Write a poem based on the following set of news headlines. You have exactly 4 lines. Remember that each line cannot exceed 18 characters including spaces and punctuation. Check your work carefully. Output only the poem, and nothing else. Poem: \n{article_title}\n"
+    try:
+        data = orjson.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    values = [data["lines"]] if "lines" in data else []
+    values += [value for name, value in data.items() if name != "lines"]
+    for value in values:
+        if isinstance(value, str) and value.strip():
+            return "\n".join(line.strip() for line in value.strip().split("\n"))
+        if isinstance(value, list) and value and all(isinstance(line, str) for line in value):
+            return "\n".join(line.strip() for line in value)
+    return None
+
+def generate_plain_poem(prompt):
+    """
+    Fallback poem request without JSON mode, for when the JSON response is unusable.
 
+    Returns:
+    str: The poem as plain text
+    """
     response = client.chat.completions.create(
         model="chatgpt-4o-latest",
         messages=[
             {"role": "system", "content": "You are a creative poet tasked with summarizing news headlines as humorous poetry. Your speciality is all of your poems are 4 lines long, and no single line of poetry can be longer than 18 characters including spaces and punctuation."},
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": prompt + "Output only the poem, and nothing else."}
         ],
         max_tokens=500
     )
+    return response.choices[0].message.content.strip()
 
-    initial_poem = response.choices[0].message.content.strip()
-    final_poem = initial_poem
+def generate_poem(article_title):
+    """
+    Use OpenAI GPT to generate a humorous poem based on the article content.
+
+    Poems are cached by headline set, so an unchanged news cycle reuses the
+    previous poem instead of calling the API again.
     
+    Returns:
+    str: A humorous poem summarizing the article
+    """
     if DEBUG:
-        print("Initial poem generated", flush=True)
+        print("Generating poem...", flush=True)
+    key = hashlib.sha256(orjson.dumps(sorted(article_title))).hexdigest()
+    cached_poem = _poem_cache.get(key)
+    if cached_poem is not None:
+        if DEBUG:
+            print("Using cached poem for this set of headlines", flush=True)
+        return cached_poem
 
-    # Second call to GPT to ensure poem fits the constraints
-    rewrite_prompt = f"Rewrite this poem to ensure it has exactly 4 lines, and each line is no more than 18 characters including spaces and punctuation. Do this step by step, and check your work, but only output the final poem:\n\n{initial_poem}\n\nRewritten poem:"
+    prompt = f"Write a poem based on the following set of news headlines. You have exactly 4 lines. Remember that each line cannot exceed 18 characters including spaces and punctuation. Check your work carefully. Poem: \n{article_title}\n"
 
-    rewrite_response = client.chat.completions.create(
+    response = client.chat.completions.create(
         model="chatgpt-4o-latest",
         messages=[
-            {"role": "system", "content": "You are a poetry editor. Your task is to rewrite poems to fit specific constraints without losing their essence."},
-            {"role": "user", "content": rewrite_prompt}
+            {"role": "system", "content": "You are a creative poet tasked with summarizing news headlines as humorous poetry. Your speciality is all of your poems are 4 lines long, and no single line of poetry can be longer than 18 characters including spaces and punctuation. "
+             "Before answering, check every line and rewrite any that break these constraints without losing the poem's essence. "
+             'Respond only with a JSON object of the form {"lines": ["...", "...", "...", "..."]}.'},
+            {"role": "user", "content": prompt}
         ],
+        response_format={"type": "json_object"},
         max_tokens=500
     )
 
-    final_poem = rewrite_response.choices[0].message.content.strip()
+    content = response.choices[0].message.content.strip()
+    final_poem = poem_from_json(content)
+    if final_poem is None:
+        if DEBUG:
+            print("Poem JSON had no usable text, requesting plain text instead", flush=True)
+        final_poem = generate_plain_poem(prompt)
+    if final_poem:
+        _poem_cache.set(key, final_poem, expire=POEM_CACHE_EXPIRE)
+
     if DEBUG:
         print("Final poem generated", flush=True)
     return final_poem
@@ -10,20 +10,27 @@ load_dotenv()
 API_URL = "https://rw.vestaboard.com/"
 API_KEY = os.getenv('VESTABOARD_READ_WRITE_KEY')
 
+# Global variables
+DEBUG = False  # Debug flag to print the full API response on success
+
+# Shared session so repeated updates reuse the same keep-alive connection
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    'X-Vestaboard-Read-Write-Key': API_KEY,
+    'Content-Type': 'application/json',
+})
+
 def update_vestaboard(text):
     """Send the formatted text to Vestaboard."""
-    headers = {
-        'X-Vestaboard-Read-Write-Key': API_KEY,
-        'Content-Type': 'application/json',
-    }
-    data = {'text': text}
-    response = requests.post(API_URL, headers=headers, json=data)
-    if response.status_code == 200:
-        print("Vestaboard updated successfully!")
-        print(f"Response: {response.json()}")
-    else:
-        print(f"Failed to update Vestaboard. Status code: {response.status_code}")
-        print(f"Response: {response.text}")
+    # Closing the response returns its connection to the session's pool right away
+    with _SESSION.post(API_URL, json={'text': text}, timeout=10, stream=False) as response:
+        if response.status_code == 200:
+            print("Vestaboard updated successfully!")
+            if DEBUG:
+                print(f"Response: {response.json()}")
+        else:
+            print(f"Failed to update Vestaboard. Status code: {response.status_code}")
+            print(f"Response: {response.text}")
 
 def read_file(file_path):
     """Read the contents of a text file."""